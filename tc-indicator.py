@@ -1,14 +1,32 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import hmac
 import hashlib
-import base64
+import binascii
 import os
+import sys
 import time
 import logging
 from colorama import Fore, Style, init
 from datetime import datetime
 import urllib.parse
 import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# Prefer orjson's C decoder for API responses when it is installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# ciso8601 parses the API's ISO-8601 timestamps far faster than strptime when installed
+try:
+    from ciso8601 import parse_datetime
+except ImportError:
+    def parse_datetime(date_string):
+        return datetime.strptime(date_string, "%Y-%m-%dT%H:%M:%SZ")
 
 
 # Initialize colorama
@@ -27,6 +45,28 @@ if not tc_accessid or not tc_secretkey:
     logging.error("Missing environment variables for Access ID or Secret Key")
     exit(1)
 
+# Number of indicator lookups kept in flight at once
+max_concurrent_queries = 8
+
+# Commas separate indicators just like whitespace does
+separator_table = str.maketrans(',', ' ')
+
+# Upper bound on indicators per batched TQL query
+max_batch_size = 50
+
+# Budget for the URL-encoded 'summary in (...)' list of one batch. Quoting can triple long values
+# (user agents, email subjects), so batches close on size as well as count to stay under 8 KB request lines.
+max_batch_query_bytes = 4096
+
+# One session for every lookup so TCP/TLS connections are kept alive and reused.
+# Rate-limited and transient gateway errors are retried on the short backoff only: Retry-After is ignored because
+# a retry resends the original Timestamp/Authorization headers, which go stale during a long server-requested wait.
+# The final response is still returned so raise_for_status() reports it as before.
+retry_policy = Retry(total=2, backoff_factor=0.2, status_forcelist=[429, 502, 503, 504],
+                     respect_retry_after_header=False, raise_on_status=False)
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_maxsize=max_concurrent_queries, max_retries=retry_policy))
+
 ioc_patterns = {
     "host": r"(?i)\b((?:(?!-)[a-zA-Z0-9-]{1,63}(?<!-)\.)+(?!apk|apt|arpa|asp|bat|bdoda|bin|bsspx|cer|cfg|cgi|class|close|cpl|cpp|crl|css|dll|doc|docx|dyn|exe|fl|gz|hlp|htm|html|ico|ini|ioc|jar|jpg|js|jxr|lco|lnk|loader|log|lxdns|mdb|mp4|odt|pcap|pdb|pdf|php|plg|plist|png|ppt|pptx|quit|rar|rtf|scr|sleep|ssl|torproject|tmp|txt|vbp|vbs|w32|wav|xls|xlsx|xml|xpi|dat($|\r\n)|gif($|\r\n)|xn$)(?:xn--[a-zA-Z0-9]{2,22}|[a-zA-Z]{2,13}))(?!.*@)",
     "ipv4": r"\b(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)\b",
@@ -44,46 +84,85 @@ ioc_patterns = {
     "email_subject": r".{1,100}",
 }
 
+# Map your internal indicator types to the expected ThreatConnect API types
+type_mapping = {
+    "ipv4": "Address",
+    "host": "Host",
+    "email_address": "EmailAddress",
+    "url": "URL",
+    "asn": "ASN",
+    "cidr": "CIDR",
+    "email_subject": "EmailSubject",
+    "mutex": "Mutex",
+    "registry_key": "Registry Key",
+    "user_agent": "User Agent",
+    # Add other mappings as necessary
+}
+
+# Types whose values are case-insensitive; all others (URL paths, mutexes, user agents, subjects,
+# registry keys) are de-duplicated and matched to results by their exact string
+case_insensitive_types = {"host", "email_address", "asn"}
+
+def indicator_key(indicator_type: str, indicator: str) -> tuple:
+    return indicator_type, (indicator.lower() if indicator_type in case_insensitive_types else indicator)
+
+# Keyed HMAC built once; each request signs with a copy so the key schedule isn't redone
+hmac_template = hmac.new(tc_secretkey.encode(), digestmod=hashlib.sha256)
+
 def generate_auth_header(api_path, query_string, http_method, timestamp):
-    message = f"{api_path}{query_string}:{http_method}:{timestamp}" if query_string else f"{api_path}:{http_method}:{timestamp}"
-    signature = base64.b64encode(hmac.new(tc_secretkey.encode(), message.encode(), hashlib.sha256).digest()).decode()
+    mac = hmac_template.copy()
+    mac.update(f"{api_path}{query_string or ''}:{http_method}:{timestamp}".encode())
+    signature = binascii.b2a_base64(mac.digest(), newline=False).decode('ascii')
     return f"TC {tc_accessid}:{signature}"
 
+compiled_ioc_patterns = {ioc_type: re.compile(pattern, re.IGNORECASE) for ioc_type, pattern in ioc_patterns.items()}
+
+# Pure function of the indicator string, so repeated indicators skip the regex cascade
+@lru_cache(maxsize=131072)
 def determine_indicator_type(indicator):
-    for ioc_type, pattern in ioc_patterns.items():
-        if re.match(pattern, indicator, re.IGNORECASE):
+    for ioc_type, pattern in compiled_ioc_patterns.items():
+        if pattern.match(indicator):
             return ioc_type
     return "unknown"
 
-def construct_tql_query(indicator_type: str, indicator: str) -> str:
-    # Map your internal indicator types to the expected ThreatConnect API types
-    type_mapping = {
-        "ipv4": "Address",
-        "host": "Host",
-        "email_address": "EmailAddress",
-        "url": "URL",
-        "asn": "ASN",
-        "cidr": "CIDR",
-        "email_subject": "EmailSubject",
-        "mutex": "Mutex",
-        "registry_key": "Registry Key",
-        "user_agent": "User Agent",
-        # Add other mappings as necessary
-    }
+def tql_quote(value: str) -> str:
+    # Escape double quotes so user input can't break out of the TQL string literal. Backslashes are sent
+    # as-is, as before, so mutex and registry values like Global\foo keep matching.
+    return '"' + value.replace('"', '\\"') + '"'
+
+def construct_tql_query(indicator_type: str, indicators: list) -> str:
     api_indicator_type = type_mapping.get(indicator_type.lower(), "Unknown")
 
-    # Construct the TQL query to filter by both type and summary
-    tql_query = f'typeName in ("{api_indicator_type}") and summary in ("{indicator}")'
+    # Construct the TQL query to filter by both type and summary; one query covers every indicator of the type
+    summaries = ", ".join(tql_quote(indicator) for indicator in indicators)
+    tql_query = f'typeName in ({tql_quote(api_indicator_type)}) and summary in ({summaries})'
     return tql_query
 
 
-def query_indicator_with_tql(indicator_type: str, indicator: str):
+def split_into_batches(indicators: list):
+    # Close a batch at max_batch_size indicators or when the encoded summary list would exceed the byte budget;
+    # an indicator that is over budget on its own still gets a batch of one
+    batch, batch_bytes = [], 0
+    for indicator in indicators:
+        indicator_bytes = len(urllib.parse.quote(tql_quote(indicator) + ", "))
+        if batch and (len(batch) == max_batch_size or batch_bytes + indicator_bytes > max_batch_query_bytes):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(indicator)
+        batch_bytes += indicator_bytes
+    if batch:
+        yield batch
+
+
+def query_indicator_with_tql(indicator_type: str, indicators: list):
+    # Returns (data, error); errors are handed back so main() can report them beside the affected indicators
     try:
-        # Ensure 'indicator' is defined and passed correctly to this function
-        tql_query = construct_tql_query(indicator_type, indicator)
+        tql_query = construct_tql_query(indicator_type, indicators)
         encoded_tql = urllib.parse.quote(tql_query)
         api_path = '/api/v3/indicators'
-        query_string = f'?tql={encoded_tql}'
+        # Allow the API's default of 100 results for each indicator in the batch (10000 is the API maximum)
+        result_limit = min(100 * len(indicators), 10000)
+        query_string = f'?tql={encoded_tql}&resultLimit={result_limit}'
         timestamp = str(int(time.time()))
         auth_header = generate_auth_header(api_path, query_string, 'GET', timestamp)
         headers = {
@@ -91,22 +170,20 @@ def query_indicator_with_tql(indicator_type: str, indicator: str):
             'Authorization': auth_header,
             'Accept': 'application/json'
         }
-        print("Please provide an instance name. Example: company.threatconnect.com")
-        # instance_name=input("Instance name: ")
         full_url = f'https://{instance_name}.threatconnect.com{api_path}{query_string}'
-        response = requests.get(full_url, headers=headers)
+        response = session.get(full_url, headers=headers)
         response.raise_for_status()
-        return response.json()
+        return json_loads(response.content), None
     except requests.exceptions.HTTPError as http_err:
-        print(Fore.RED + f"HTTP error occurred: {http_err.response.status_code} - {http_err.response.text}")
+        error = f"HTTP error occurred: {http_err.response.status_code} - {http_err.response.text}"
     except requests.exceptions.RequestException as req_err:
-        print(Fore.RED + f"Request error occurred: {req_err}")
+        error = f"Request error occurred: {req_err}"
     except Exception as err:
-        # If this line throws the error, ensure 'indicator' is correctly passed to the function
-        print(Fore.RED + f"An unexpected error occurred: {err}")
-    return None
+        error = f"An unexpected error occurred: {err}"
+    return None, error
 
 def format_and_print_indicator_data(indicator_data):
+    parts = []
     for indicator in indicator_data:
         # Assuming 'dateAdded', 'lastModified', etc., are the correct keys in your data
         date_added = indicator.get('dateAdded', 'N/A')
@@ -114,46 +191,86 @@ def format_and_print_indicator_data(indicator_data):
         summary = indicator.get('summary', 'N/A')
         # Convert date strings to datetime objects if they are not 'N/A'
         if date_added != 'N/A':
-            date_added = datetime.strptime(date_added, "%Y-%m-%dT%H:%M:%SZ").strftime("%B %d, %Y %H:%M:%S")
+            date_added = parse_datetime(date_added).strftime("%B %d, %Y %H:%M:%S")
         if last_modified != 'N/A':
-            last_modified = datetime.strptime(last_modified, "%Y-%m-%dT%H:%M:%SZ").strftime("%B %d, %Y %H:%M:%S")
-
-        print(f"{Fore.RED}{Style.BRIGHT}Summary:{Style.RESET_ALL} {indicator.get('summary', 'N/A')}")
-        print(f"{Fore.RED}{Style.BRIGHT}Date Added:{Style.RESET_ALL} {date_added}")
-        print(f"{Fore.RED}{Style.BRIGHT}Last Modified:{Style.RESET_ALL} {last_modified}")
-        print(f"{Fore.RED}{Style.BRIGHT}Type:{Style.RESET_ALL} {indicator.get('type', 'N/A')}")
-        print(f"{Fore.RED}{Style.BRIGHT}Rating:{Style.RESET_ALL} {'💀' * int(indicator.get('rating', 0))} ({indicator.get('rating', 'N/A')}/5)")
-        print(f"{Fore.RED}{Style.BRIGHT}Confidence:{Style.RESET_ALL} {indicator.get('confidence', 'N/A')}%")
-        print(f"{Fore.RED}{Style.BRIGHT}Owner:{Style.RESET_ALL} {indicator.get('ownerName', 'N/A')}")
-        print(f"{Fore.RED}{Style.BRIGHT}Active:{Style.RESET_ALL} {'Yes' if indicator.get('active', False) else 'No'}")
-        print(f"{Fore.RED}{Style.BRIGHT}Web Link:{Style.RESET_ALL} {indicator.get('webLink', 'N/A')}")
+            last_modified = parse_datetime(last_modified).strftime("%B %d, %Y %H:%M:%S")
+
+        parts.append(f"{Fore.RED}{Style.BRIGHT}Summary:{Style.RESET_ALL} {indicator.get('summary', 'N/A')}\n")
+        parts.append(f"{Fore.RED}{Style.BRIGHT}Date Added:{Style.RESET_ALL} {date_added}\n")
+        parts.append(f"{Fore.RED}{Style.BRIGHT}Last Modified:{Style.RESET_ALL} {last_modified}\n")
+        parts.append(f"{Fore.RED}{Style.BRIGHT}Type:{Style.RESET_ALL} {indicator.get('type', 'N/A')}\n")
+        parts.append(f"{Fore.RED}{Style.BRIGHT}Rating:{Style.RESET_ALL} {'💀' * int(indicator.get('rating', 0))} ({indicator.get('rating', 'N/A')}/5)\n")
+        parts.append(f"{Fore.RED}{Style.BRIGHT}Confidence:{Style.RESET_ALL} {indicator.get('confidence', 'N/A')}%\n")
+        parts.append(f"{Fore.RED}{Style.BRIGHT}Owner:{Style.RESET_ALL} {indicator.get('ownerName', 'N/A')}\n")
+        parts.append(f"{Fore.RED}{Style.BRIGHT}Active:{Style.RESET_ALL} {'Yes' if indicator.get('active', False) else 'No'}\n")
+        parts.append(f"{Fore.RED}{Style.BRIGHT}Web Link:{Style.RESET_ALL} {indicator.get('webLink', 'N/A')}\n")
         #if 'legacyLink' in indicator:
-            # print(f"{Fore.RED}{Style.BRIGHT}Legacy Link:{Style.RESET_ALL} {indicator.get('legacyLink', 'N/A')}")
+            # parts.append(f"{Fore.RED}{Style.BRIGHT}Legacy Link:{Style.RESET_ALL} {indicator.get('legacyLink', 'N/A')}\n")
         if 'source' in indicator:
-            print(f"{Fore.RED}{Style.BRIGHT}Source:{Style.RESET_ALL} {indicator.get('source', 'N/A')}")
+            parts.append(f"{Fore.RED}{Style.BRIGHT}Source:{Style.RESET_ALL} {indicator.get('source', 'N/A')}\n")
 
         description = indicator.get('description', 'No description available.')
-        print("\n" + f"{Fore.RED}{Style.BRIGHT}Description:{Style.RESET_ALL}\n{description}\n")
+        parts.append("\n" + f"{Fore.RED}{Style.BRIGHT}Description:{Style.RESET_ALL}\n{description}\n\n")
 
-        print("-" * 40 + "\n")
+        parts.append("-" * 40 + "\n\n")
+
+    # One write for the whole batch instead of a dozen print() calls per indicator. On a terminal, colorama's
+    # autoreset now adds a single trailing reset per block instead of one per line; every label already ends
+    # in RESET_ALL, so the rendered output is unchanged.
+    sys.stdout.write(''.join(parts))
+    sys.stdout.flush()
 
 def main():
+    global instance_name
+    if not instance_name:
+        print("Please provide an instance name. Example: company (for company.threatconnect.com)")
+        instance_name = input("Instance name: ").strip()
+
     print("Enter indicators (separated by line, type 'end' to stop): ")
     indicators = []
     while True:
         line = input()
         if line.strip().lower() == 'end':
             break
-        indicators.extend(re.split(r'[,\n\s]+', line.strip()))
+        indicators.extend(line.translate(separator_table).split())
 
-    for indicator in indicators:
-        if indicator:  # Ensure the indicator is not empty
-            indicator_type = determine_indicator_type(indicator)
-            print(Fore.YELLOW + f"Processing Indicator: {indicator}, Type: {indicator_type}")
-            data = query_indicator_with_tql(indicator_type, indicator)  # Correctly pass 'indicator' here
+    indicator_types = [determine_indicator_type(indicator) for indicator in indicators]
+
+    # Group unique indicators by type so each type is looked up with batched TQL queries
+    batches = {}
+    for indicator, indicator_type in zip(indicators, indicator_types):
+        # Repeats are dropped with the same key used to match results back (first spelling wins)
+        batches.setdefault(indicator_type, {}).setdefault(indicator_key(indicator_type, indicator), indicator)
+    batch_types, batch_indicators = [], []
+    for indicator_type, unique_indicators in batches.items():
+        for batch in split_into_batches(list(unique_indicators.values())):
+            batch_types.append(indicator_type)
+            batch_indicators.append(batch)
+
+    # Lookups are network-bound, so run the batches concurrently
+    matches = {}
+    failed = {}  # indicator key -> error message (None when the query simply didn't succeed)
+    with ThreadPoolExecutor(max_workers=max_concurrent_queries) as executor:
+        results = executor.map(query_indicator_with_tql, batch_types, batch_indicators)
+        for indicator_type, batch, (data, error) in zip(batch_types, batch_indicators, results):
             if data and 'data' in data and data['status'] == 'Success':
-                format_and_print_indicator_data(data['data'])
+                for item in data['data']:
+                    matches.setdefault(indicator_key(indicator_type, str(item.get('summary', ''))), []).append(item)
             else:
-                print(Fore.RED + "No data returned from the query or an error occurred.")
+                if error:
+                    error = f"{error} (batched lookup of {len(batch)} {indicator_type} indicator(s))"
+                for indicator in batch:
+                    failed[indicator_key(indicator_type, indicator)] = error
+
+    for indicator, indicator_type in zip(indicators, indicator_types):
+        print(Fore.YELLOW + f"Processing Indicator: {indicator}, Type: {indicator_type}")
+        key = indicator_key(indicator_type, indicator)
+        if key in failed:
+            error = failed[key]
+            if error:
+                print(Fore.RED + error)
+            print(Fore.RED + "No data returned from the query or an error occurred.")
+        else:
+            format_and_print_indicator_data(matches.get(key, []))
 if __name__ == "__main__":
     main()